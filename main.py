@@ -1,33 +1,198 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field, validator
-from typing import List, Optional
-import paramiko
-import io
-import base64
-from datetime import datetime
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipResponder
+from pydantic import BaseModel, Field, field_validator
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple, Union
+import asyncio
+import asyncssh
+from asyncssh.sftp import SAFE_SFTP_READ_LEN
+import hashlib
+import orjson
+import os
+import pybase64
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, aclosing, asynccontextmanager, suppress
+from datetime import datetime, timezone
+from urllib.parse import quote
 import logging
+import logging.handlers
+import queue
+import re
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def start_log_listener() -> logging.handlers.QueueListener:
+    """
+    Déplace l'écriture des logs vers un thread dédié
+    
+    Les handlers du logger racine sont confiés à un QueueListener ; le logger
+    racine ne fait plus que mettre les messages en file.
+    """
+    root = logging.getLogger()
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    listener.start()
+    return listener
+
+def stop_log_listener(listener: logging.handlers.QueueListener):
+    """Vide la file de logs et rend ses handlers au logger racine"""
+    listener.stop()
+    logging.getLogger().handlers = list(listener.handlers)
+
 # Custom log handler to capture logs
 class LogCapture:
     def __init__(self):
         self.logs = []
+        self._last_second = None
+        self._clock = ""
     
     def add(self, message: str):
-        self.logs.append(f"[{datetime.utcnow().strftime('%H:%M:%S')}] {message}")
+        # L'horodatage n'est reformaté qu'une fois par seconde
+        now_second = int(time.time())
+        if now_second != self._last_second:
+            self._last_second = now_second
+            self._clock = time.strftime('%H:%M:%S', time.gmtime(now_second))
+        self.logs.append(f"[{self._clock}] {message}")
         logger.info(message)
     
     def get_logs(self) -> List[str]:
         return self.logs
 
+# Nombre de threads pour le travail bloquant exécuté hors de la boucle d'événements
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "64"))
+
+# Nombre maximal de téléchargements simultanés sur une même session SFTP
+MAX_CONCURRENT_DOWNLOADS = 16
+
+# Fenêtre de lecture SFTP : nombre de requêtes READ en vol et taille de chaque bloc
+# (-1 : taille maximale annoncée par le serveur via limits@openssh.com, sinon SFTP_FALLBACK_BLOCK_SIZE)
+SFTP_MAX_REQUESTS = int(os.getenv("SFTP_MAX_REQUESTS", "64"))
+SFTP_BLOCK_SIZE = int(os.getenv("SFTP_BLOCK_SIZE", "-1"))
+if SFTP_BLOCK_SIZE != -1 and SFTP_BLOCK_SIZE <= 0:
+    raise ValueError(f"SFTP_BLOCK_SIZE doit valoir -1 ou être strictement positif (reçu : {SFTP_BLOCK_SIZE})")
+
+# Taille des blocs pour les serveurs qui n'annoncent pas leurs limites (OpenSSH < 8.6...) :
+# 255 Kio, la limite de lecture d'OpenSSH, au lieu des 16 Kio de repli d'asyncssh
+SFTP_FALLBACK_BLOCK_SIZE = 261120
+
+# Cache des clés privées déjà importées (empreinte SHA-256 -> clé asyncssh)
+KEY_CACHE_SIZE = 256
+_key_cache: "OrderedDict[bytes, asyncssh.SSHKey]" = OrderedDict()
+
+# Pool de sessions SFTP : nombre maximal de sessions inactives et durée d'inactivité (secondes)
+SFTP_POOL_MAX_SIZE = int(os.getenv("SFTP_POOL_MAX_SIZE", "32"))
+SFTP_POOL_IDLE_TIMEOUT = float(os.getenv("SFTP_POOL_IDLE_TIMEOUT", "300"))
+
+# Clés d'hôte connues, chargées une seule fois au démarrage (vérification désactivée si non configuré)
+KNOWN_HOSTS_PATH = os.getenv("KNOWN_HOSTS_PATH")
+KNOWN_HOSTS = asyncssh.read_known_hosts(KNOWN_HOSTS_PATH) if KNOWN_HOSTS_PATH else None
+
+# Chiffrements SSH par ordre de préférence : AES-GCM (accéléré par AES-NI), puis
+# ChaCha20-Poly1305 (rapide sans AES matériel), puis AES-CTR pour les anciens serveurs
+SSH_ENCRYPTION_ALGS = [
+    'aes128-gcm@openssh.com',
+    'aes256-gcm@openssh.com',
+    'chacha20-poly1305@openssh.com',
+    'aes128-ctr',
+    'aes256-ctr'
+]
+
+# Taille (octets) à partir de laquelle une réponse est compressée hors de la boucle d'événements
+# (GZipMiddleware compresse le corps en un seul appel synchrone, environ 40 ms par Mo)
+GZIP_THREAD_MIN_SIZE = int(os.getenv("GZIP_THREAD_MIN_SIZE", str(256 * 1024)))
+
+# Types de contenu transmis sans compression (contenu binaire peu compressible)
+GZIP_EXCLUDED_MEDIA_TYPES = ("multipart/", "application/octet-stream")
+
+class ThreadedGZipResponder(GZipResponder):
+    """
+    GZipResponder qui laisse passer les flux binaires et compresse les gros
+    corps dans un thread
+    """
+    
+    def __init__(self, app, minimum_size: int, compresslevel: int = 9):
+        super().__init__(app, minimum_size, compresslevel=compresslevel)
+        self.excluded = False
+    
+    def _compress_all(self, body: bytes) -> bytes:
+        self.gzip_file.write(body)
+        self.gzip_file.close()
+        return self.gzip_buffer.getvalue()
+    
+    async def send_with_gzip(self, message):
+        if message["type"] == "http.response.start":
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            self.excluded = content_type.startswith(GZIP_EXCLUDED_MEDIA_TYPES)
+        elif message["type"] == "http.response.body" and self.excluded:
+            if not self.started:
+                self.started = True
+                await self.send(self.initial_message)
+            await self.send(message)
+            return
+        elif (
+            message["type"] == "http.response.body"
+            and not self.started
+            and not self.content_encoding_set
+            and not message.get("more_body", False)
+            and len(message.get("body", b"")) >= GZIP_THREAD_MIN_SIZE
+        ):
+            # Corps complet volumineux : même traitement que GZipResponder, compression hors de la boucle
+            self.started = True
+            body = await asyncio.to_thread(self._compress_all, message["body"])
+            headers = MutableHeaders(raw=self.initial_message["headers"])
+            headers["Content-Encoding"] = "gzip"
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            message["body"] = body
+            await self.send(self.initial_message)
+            await self.send(message)
+            return
+        await super().send_with_gzip(message)
+
+class ThreadedGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware utilisant ThreadedGZipResponder"""
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and "gzip" in Headers(scope=scope).get("Accept-Encoding", ""):
+            responder = ThreadedGZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+            await responder(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_listener = start_log_listener()
+    
+    # Pool de threads dédié aux appels bloquants (asyncio.to_thread), dimensionné explicitement
+    executor = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="sftp-worker")
+    asyncio.get_running_loop().set_default_executor(executor)
+    
+    # Pas de balayage quand le pool est désactivé (SFTP_POOL_IDLE_TIMEOUT <= 0)
+    pool_sweeper = asyncio.create_task(sftp_pool.evict_periodically()) if sftp_pool.enabled else None
+    yield
+    if pool_sweeper is not None:
+        pool_sweeper.cancel()
+        with suppress(asyncio.CancelledError):
+            await pool_sweeper
+    await sftp_pool.close()
+    executor.shutdown(wait=False)
+    stop_log_listener(log_listener)
+
 app = FastAPI(
     title="SFTP Microservice",
     description="Microservice pour connexion SFTP avec authentification par clé SSH",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Configuration CORS
@@ -39,6 +204,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compression des réponses (le JSON base64 se compresse bien ; les flux multipart ne sont pas compressés)
+app.add_middleware(ThreadedGZipMiddleware, minimum_size=4096, compresslevel=4)
+
+# En-tête PEM d'une clé privée (OPENSSH, RSA, EC, DSA, PKCS#8...)
+_PEM_PRIVATE_KEY_RE = re.compile(r'-----BEGIN (?:[A-Z0-9]+ )*PRIVATE KEY-----')
+
 # Modèles Pydantic pour validation
 class ExpectedFile(BaseModel):
     filename: str = Field(..., min_length=1, max_length=255)
@@ -48,11 +219,12 @@ class SFTPConnectionConfig(BaseModel):
     hostname: str = Field(..., min_length=1, max_length=255)
     port: int = Field(default=22, ge=1, le=65535)
     username: str = Field(..., min_length=1, max_length=255)
-    private_key: str = Field(..., min_length=10)
+    private_key: str = Field(..., min_length=10, max_length=65536)
     
-    @validator('private_key')
-    def validate_private_key(cls, v):
-        if not ('BEGIN' in v and 'PRIVATE KEY' in v):
+    @field_validator('private_key')
+    @classmethod
+    def validate_private_key(cls, v: str) -> str:
+        if not _PEM_PRIVATE_KEY_RE.search(v):
             raise ValueError('Invalid private key format')
         return v
 
@@ -81,80 +253,432 @@ async def health_check():
         "status": "healthy",
         "service": "sftp-microservice",
         "version": "1.0.0",
-        "timestamp": datetime.utcnow().isoformat()
+        "timestamp": datetime.now(timezone.utc).isoformat()
     }
 
-@app.post("/download-files", response_model=DownloadResponse)
-async def download_files(request: DownloadRequest):
+class SFTPConnectionPool:
+    """
+    Pool de sessions SFTP réutilisables entre les requêtes
+    
+    Les sessions sont indexées par (hôte, port, utilisateur, empreinte de clé) :
+    une requête suivante vers le même serveur évite ainsi la poignée de main
+    TCP + SSH et l'authentification.
+    """
+    
+    def __init__(self, max_size: int, idle_timeout: float):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._idle: Dict[str, List[Tuple[asyncssh.SSHClientConnection, asyncssh.SFTPClient, float]]] = {}
+    
+    @property
+    def enabled(self) -> bool:
+        """Un délai d'inactivité nul ou négatif désactive la réutilisation des sessions"""
+        return self.idle_timeout > 0
+    
+    @staticmethod
+    def _pool_key(config: SFTPConnectionConfig, key_fp: bytes) -> str:
+        identity = f"{config.hostname}\0{config.port}\0{config.username}\0".encode('utf-8')
+        return hashlib.blake2s(identity + key_fp).hexdigest()
+    
+    def _idle_count(self) -> int:
+        return sum(len(sessions) for sessions in self._idle.values())
+    
+    def _evict_expired(self):
+        """Ferme les sessions inactives depuis plus de idle_timeout"""
+        deadline = time.monotonic() - self.idle_timeout
+        for pool_key in list(self._idle):
+            sessions = self._idle[pool_key]
+            for conn, _, last_used in sessions:
+                if last_used < deadline:
+                    conn.close()
+            sessions[:] = [entry for entry in sessions if entry[2] >= deadline]
+            if not sessions:
+                del self._idle[pool_key]
+    
+    async def evict_periodically(self):
+        """Ferme régulièrement les sessions expirées, même en l'absence de trafic"""
+        while True:
+            await asyncio.sleep(max(1.0, min(self.idle_timeout, 60.0)))
+            self._evict_expired()
+    
+    async def _connect(
+        self,
+        config: SFTPConnectionConfig,
+        private_key: asyncssh.SSHKey,
+        log_capture: LogCapture
+    ) -> Tuple[asyncssh.SSHClientConnection, asyncssh.SFTPClient]:
+        # Connexion SSH avec timeouts augmentés
+        log_capture.add(f"🔌 Tentative de connexion SSH vers {config.hostname}:{config.port}")
+        log_capture.add(f"👤 Utilisateur: {config.username}")
+        conn = await asyncssh.connect(
+            config.hostname,
+            port=config.port,
+            username=config.username,
+            client_keys=[private_key],
+            known_hosts=KNOWN_HOSTS,  # None : clé d'hôte acceptée sans vérification
+            connect_timeout=120,  # 2 minutes
+            login_timeout=60,  # 1 minute
+            keepalive_interval=30,  # Connexion morte détectée après ~3 minutes
+            keepalive_count_max=6,
+            encryption_algs=SSH_ENCRYPTION_ALGS,
+            compression_algs=None  # Pas de compression SSH (la réponse est déjà compressée en gzip)
+        )
+        log_capture.add("✅ Connexion SSH établie avec succès")
+        
+        # Ouvrir la session SFTP
+        try:
+            log_capture.add("📂 Ouverture de la session SFTP...")
+            sftp = await conn.start_sftp_client()
+        except BaseException:
+            conn.close()
+            raise
+        log_capture.add(f"✅ Session SFTP établie")
+        return conn, sftp
+    
+    async def _checkout(self, pool_key: str) -> Optional[Tuple[asyncssh.SSHClientConnection, asyncssh.SFTPClient]]:
+        """Récupère une session inactive encore valide, s'il en existe une"""
+        sessions = self._idle.get(pool_key, [])
+        while sessions:
+            conn, sftp, _ = sessions.pop()
+            try:
+                await sftp.realpath('.')
+                return conn, sftp
+            except Exception:
+                conn.close()
+        return None
+    
+    @asynccontextmanager
+    async def acquire(
+        self,
+        config: SFTPConnectionConfig,
+        private_key: asyncssh.SSHKey,
+        key_fp: bytes,
+        log_capture: LogCapture
+    ) -> AsyncIterator[asyncssh.SFTPClient]:
+        """Fournit une session SFTP, rendue au pool à la sortie du bloc"""
+        pool_key = self._pool_key(config, key_fp)
+        self._evict_expired()
+        
+        session = await self._checkout(pool_key)
+        if session is not None:
+            log_capture.add("♻️ Réutilisation d'une session SFTP existante")
+        else:
+            session = await self._connect(config, private_key, log_capture)
+        conn, sftp = session
+        
+        try:
+            yield sftp
+        except BaseException:
+            # Par prudence, une session ayant rencontré une erreur n'est pas réutilisée
+            conn.close()
+            raise
+        
+        if self.enabled and self._idle_count() < self.max_size:
+            self._idle.setdefault(pool_key, []).append((conn, sftp, time.monotonic()))
+            logger.info("Session SFTP rendue au pool")
+        else:
+            conn.close()
+            logger.info("Connexions fermées")
+    
+    async def close(self):
+        """Ferme toutes les sessions inactives"""
+        for sessions in self._idle.values():
+            for conn, _, _ in sessions:
+                conn.close()
+        self._idle.clear()
+        logger.info("Pool SFTP fermé")
+
+sftp_pool = SFTPConnectionPool(max_size=SFTP_POOL_MAX_SIZE, idle_timeout=SFTP_POOL_IDLE_TIMEOUT)
+
+def key_fingerprint(private_key: str) -> bytes:
+    """Empreinte SHA-256 du PEM, utilisée comme clé de cache"""
+    return hashlib.sha256(private_key.encode('utf-8')).digest()
+
+async def load_private_key(key_fp: bytes, private_key: str) -> asyncssh.SSHKey:
+    """
+    Importe une clé privée en réutilisant le cache LRU indexé par empreinte
+    
+    Le parsing (coûteux en CPU) est exécuté hors de la boucle d'événements.
+    """
+    key = _key_cache.get(key_fp)
+    if key is not None:
+        _key_cache.move_to_end(key_fp)
+        return key
+    
+    key = await asyncio.to_thread(asyncssh.import_private_key, private_key)
+    _key_cache[key_fp] = key
+    if len(_key_cache) > KEY_CACHE_SIZE:
+        _key_cache.popitem(last=False)
+    return key
+
+def read_block_size(sftp: asyncssh.SFTPClient) -> int:
+    """Taille des requêtes READ pour cette session SFTP"""
+    if SFTP_BLOCK_SIZE != -1:
+        return SFTP_BLOCK_SIZE
+    # Sans limits@openssh.com, asyncssh conserve sa valeur de repli (SAFE_SFTP_READ_LEN)
+    if sftp.limits.max_read_len == SAFE_SFTP_READ_LEN:
+        return SFTP_FALLBACK_BLOCK_SIZE
+    return -1
+
+async def read_chunks(sftp: asyncssh.SFTPClient, remote_file_path: str) -> AsyncIterator[bytes]:
+    """
+    Lit un fichier distant par morceaux couvrant toute la fenêtre de lecture SFTP
+    
+    Le morceau suivant est demandé au serveur pendant le traitement du morceau courant.
+    """
+    async with sftp.open(
+        remote_file_path, 'rb',
+        block_size=read_block_size(sftp),
+        max_requests=SFTP_MAX_REQUESTS
+    ) as remote_file:
+        # Un morceau = SFTP_MAX_REQUESTS blocs, arrondi à un multiple de 3 blocs
+        # (taille multiple de 3 : pas de padding base64 intermédiaire)
+        chunk_size = remote_file.read_len * max(3, SFTP_MAX_REQUESTS // 3 * 3)
+        offset = 0
+        next_read = asyncio.ensure_future(remote_file.read(chunk_size, 0))
+        try:
+            while next_read is not None:
+                chunk = await next_read
+                next_read = None
+                if not chunk:
+                    break
+                offset += len(chunk)
+                # Un morceau incomplet signale la fin du fichier : pas de lecture anticipée
+                if len(chunk) == chunk_size:
+                    next_read = asyncio.ensure_future(remote_file.read(chunk_size, offset))
+                yield chunk
+        finally:
+            if next_read is not None:
+                # Annuler la lecture laisserait tourner les requêtes par bloc d'asyncssh
+                # sur un handle fermé : on la laisse se terminer avant la fermeture
+                with suppress(Exception):
+                    await next_read
+
+async def fetch_one(
+    sftp: asyncssh.SFTPClient,
+    remote_path: str,
+    expected_file: ExpectedFile,
+    available_files: Set[str],
+    semaphore: asyncio.Semaphore,
+    log_capture: LogCapture
+) -> Union[DownloadedFile, str]:
+    """
+    Télécharge un fichier attendu via la session SFTP
+    
+    Returns:
+        Le fichier téléchargé, ou son nom s'il est manquant ou en erreur
+    """
+    filename = expected_file.filename
+    
+    # Vérifier si le fichier existe
+    if filename not in available_files:
+        log_capture.add(f"⚠️ Fichier manquant: {filename}")
+        return filename
+    
+    # Télécharger le fichier
+    async with semaphore:
+        try:
+            remote_file_path = f"{remote_path}/{filename}"
+            
+            download_start = time.monotonic_ns()
+            log_capture.add(f"⬇️ Téléchargement: {filename}")
+            
+            # Vérifier la taille du fichier d'abord
+            file_attrs = await sftp.stat(remote_file_path)
+            file_size_mb = file_attrs.size / (1024 * 1024)
+            log_capture.add(f"   Taille {filename}: {file_size_mb:.2f} MB")
+            
+            # Encoder en base64 au fil de l'eau, sans garder le fichier brut en mémoire
+            encoded = bytearray()
+            size = 0
+            async for chunk in read_chunks(sftp, remote_file_path):
+                size += len(chunk)
+                encoded += await asyncio.to_thread(pybase64.b64encode, chunk)
+            
+            download_duration = (time.monotonic_ns() - download_start) / 1e9
+            log_capture.add(f"   ✅ {filename} terminé en {download_duration:.2f}s")
+            
+            log_capture.add(f"✓ {filename} téléchargé ({size} bytes)")
+            
+            return DownloadedFile(
+                filename=filename,
+                content_base64=encoded.decode('ascii'),
+                size=size,
+                download_time=datetime.now(timezone.utc).isoformat()
+            )
+            
+        except Exception as e:
+            log_capture.add(f"❌ Erreur téléchargement {filename}: {str(e)}")
+            return filename
+
+def multipart_part_header(boundary: str, content_type: str, filename: Optional[str] = None) -> bytes:
+    """En-tête d'une partie multipart/mixed"""
+    header = f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+    if filename is not None:
+        header += f"Content-Disposition: attachment; filename*=UTF-8''{quote(filename)}\r\n"
+    return (header + "\r\n").encode('utf-8')
+
+async def stream_files(
+    sftp: asyncssh.SFTPClient,
+    request: DownloadRequest,
+    available_files: Set[str],
+    boundary: str,
+    start_time: int,
+    log_capture: LogCapture
+) -> AsyncIterator[bytes]:
+    """
+    Génère le corps multipart/mixed : une partie binaire par fichier téléchargé,
+    puis une partie JSON récapitulative (fichiers manquants, statistiques, logs)
+    """
+    # Un fichier demandé plusieurs fois n'est transmis qu'une seule fois
+    downloaded_sizes = {}
+    for filename in dict.fromkeys(f.filename for f in request.expected_files):
+        if filename not in available_files:
+            log_capture.add(f"⚠️ Fichier manquant: {filename}")
+            continue
+        
+        log_capture.add(f"⬇️ Téléchargement: {filename}")
+        async with aclosing(read_chunks(sftp, f"{request.remote_path}/{filename}")) as chunks:
+            # Ouvrir le fichier et lire le premier morceau avant d'entamer la partie :
+            # un échec d'ouverture n'apparaît que dans le récapitulatif, sans partie vide
+            try:
+                first_chunk = await anext(chunks, b"")
+            except Exception as e:
+                log_capture.add(f"❌ Erreur téléchargement {filename}: {str(e)}")
+                continue
+            
+            yield multipart_part_header(boundary, "application/octet-stream", filename)
+            size = len(first_chunk)
+            try:
+                if first_chunk:
+                    yield first_chunk
+                async for chunk in chunks:
+                    size += len(chunk)
+                    yield chunk
+            except Exception as e:
+                # La partie est déjà entamée : le fichier est signalé comme manquant dans le récapitulatif
+                log_capture.add(f"❌ Erreur téléchargement {filename}: {str(e)}")
+            else:
+                downloaded_sizes[filename] = size
+                log_capture.add(f"✓ {filename} téléchargé ({size} bytes)")
+        yield b"\r\n"
+    
+    # Statistiques comptées par fichier demandé, comme pour la réponse JSON
+    missing_files = [f.filename for f in request.expected_files if f.filename not in downloaded_sizes]
+    downloaded_count = len(request.expected_files) - len(missing_files)
+    total_size = sum(downloaded_sizes.get(f.filename, 0) for f in request.expected_files)
+    
+    duration = (time.monotonic_ns() - start_time) / 1e9
+    stats = {
+        "total_expected": len(request.expected_files),
+        "total_downloaded": downloaded_count,
+        "total_missing": len(missing_files),
+        "total_size_bytes": total_size,
+        "duration_seconds": round(duration, 2)
+    }
+    log_capture.add(f"✅ Téléchargement terminé: {downloaded_count}/{len(request.expected_files)} fichier(s)")
+    
+    summary = {
+        "success": len(missing_files) == 0,
+        "missing_files": missing_files,
+        "stats": stats,
+        "logs": log_capture.get_logs()
+    }
+    yield multipart_part_header(boundary, "application/json; charset=utf-8")
+    yield orjson.dumps(summary)
+    yield f"\r\n--{boundary}--\r\n".encode('utf-8')
+
+class SessionStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse propriétaire d'une session SFTP du pool
+    
+    La session n'est rendue au pool que si le flux a été parcouru jusqu'au bout.
+    Un envoi interrompu (déconnexion du client, erreur) peut laisser des fichiers
+    ouverts sur le serveur : la connexion est alors fermée.
+    """
+    
+    def __init__(self, content: AsyncIterator[bytes], session: AsyncExitStack, **kwargs):
+        self.session = session
+        self.completed = False
+        super().__init__(self._track_completion(content), **kwargs)
+    
+    async def _track_completion(self, content: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        async with aclosing(content):
+            async for chunk in content:
+                yield chunk
+        self.completed = True
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            try:
+                await super().__call__(scope, receive, send)
+            finally:
+                # Fermer le générateur d'abord, pour terminer les lectures en cours sur la session
+                await self.body_iterator.aclose()
+        except BaseException as exc:
+            await self.session.__aexit__(type(exc), exc, exc.__traceback__)
+            raise
+        if self.completed:
+            await self.session.aclose()
+        else:
+            # Starlette termine la réponse sans erreur quand le client se déconnecte
+            exc = ConnectionAbortedError("Flux multipart interrompu avant la fin")
+            await self.session.__aexit__(type(exc), exc, None)
+            logger.info("Flux multipart interrompu : session SFTP fermée")
+
+def accepts_multipart(accept: Optional[str]) -> bool:
+    """
+    Indique si l'en-tête Accept demande explicitement multipart/mixed
+    
+    multipart/mixed doit avoir un q > 0, au moins égal à celui de application/json.
+    """
+    qualities = {}
+    for media_range in (accept or "").split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[media_type.lower()] = quality
+    
+    multipart_quality = qualities.get("multipart/mixed", 0.0)
+    return multipart_quality > 0 and multipart_quality >= qualities.get("application/json", 0.0)
+
+@app.post(
+    "/download-files",
+    response_model=DownloadResponse,
+    responses={200: {"content": {"multipart/mixed": {}}}}
+)
+async def download_files(request: DownloadRequest, accept: Optional[str] = Header(default=None)):
     """
     Télécharge des fichiers depuis un serveur SFTP
     
     Args:
         request: Configuration de connexion et liste des fichiers attendus
+        accept: Avec "multipart/mixed", les fichiers sont transmis en flux binaire
+            au lieu d'être encodés en base64 dans une réponse JSON
         
     Returns:
         Informations sur les fichiers téléchargés et manquants
     """
-    ssh_client = None
-    sftp_client = None
     downloaded_files = []
     missing_files = []
-    start_time = datetime.utcnow()
+    total_size = 0
+    start_time = time.monotonic_ns()
     log_capture = LogCapture()
     
     try:
         log_capture.add(f"🚀 Démarrage de la connexion SFTP vers {request.connection.hostname}:{request.connection.port}")
         
-        # Créer le client SSH
-        ssh_client = paramiko.SSHClient()
-        ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        
-        # Charger la clé privée avec une meilleure compatibilité
-        key_errors = []
-        private_key = None
-        
+        # Charger la clé privée (asyncssh détecte automatiquement le format)
         try:
-            from cryptography.hazmat.primitives import serialization as crypto_serialization
-            from cryptography.hazmat.primitives.asymmetric import ed25519, dsa, rsa, ec
-            
-            # Charger la clé avec cryptography (supporte mieux les formats modernes)
-            file_bytes = request.connection.private_key.encode('utf-8')
-            try:
-                key = crypto_serialization.load_ssh_private_key(
-                    file_bytes,
-                    password=None,
-                )
-            except ValueError:
-                key = crypto_serialization.load_pem_private_key(
-                    file_bytes,
-                    password=None,
-                )
-            
-            # Convertir au format PEM OpenSSH que paramiko peut lire
-            pem_key = key.private_bytes(
-                crypto_serialization.Encoding.PEM,
-                crypto_serialization.PrivateFormat.OpenSSH,
-                crypto_serialization.NoEncryption(),
-            ).decode('utf-8')
-            
-            # Charger avec paramiko selon le type de clé
-            key_file = io.StringIO(pem_key)
-            
-            if isinstance(key, rsa.RSAPrivateKey):
-                private_key = paramiko.RSAKey.from_private_key(key_file)
-                log_capture.add("🔑 Clé RSA chargée avec succès")
-            elif isinstance(key, ed25519.Ed25519PrivateKey):
-                private_key = paramiko.Ed25519Key.from_private_key(key_file)
-                log_capture.add("🔑 Clé Ed25519 chargée avec succès")
-            elif isinstance(key, ec.EllipticCurvePrivateKey):
-                private_key = paramiko.ECDSAKey.from_private_key(key_file)
-                log_capture.add("🔑 Clé ECDSA chargée avec succès")
-            elif isinstance(key, dsa.DSAPrivateKey):
-                private_key = paramiko.DSSKey.from_private_key(key_file)
-                log_capture.add("🔑 Clé DSA chargée avec succès")
-            else:
-                raise ValueError(f"Type de clé non supporté: {type(key)}")
-                
+            key_fp = key_fingerprint(request.connection.private_key)
+            private_key = await load_private_key(key_fp, request.connection.private_key)
+            log_capture.add(f"🔑 Clé {private_key.get_algorithm()} chargée avec succès")
         except Exception as e:
             log_capture.add(f"❌ Erreur lors du chargement de la clé: {str(e)}")
             raise HTTPException(
@@ -162,106 +686,75 @@ async def download_files(request: DownloadRequest):
                 detail=f"Impossible de charger la clé privée: {str(e)}"
             )
         
-        # Connexion SSH avec timeouts augmentés
-        log_capture.add(f"🔌 Tentative de connexion SSH vers {request.connection.hostname}:{request.connection.port}")
-        log_capture.add(f"👤 Utilisateur: {request.connection.username}")
-        ssh_client.connect(
-            hostname=request.connection.hostname,
-            port=request.connection.port,
-            username=request.connection.username,
-            pkey=private_key,
-            timeout=120,  # Augmenté à 2 minutes
-            auth_timeout=60,  # Augmenté à 1 minute
-            banner_timeout=60
-        )
-        log_capture.add("✅ Connexion SSH établie avec succès")
-        
-        # Ouvrir la connexion SFTP avec timeout
-        log_capture.add("📂 Ouverture de la session SFTP...")
-        sftp_client = ssh_client.open_sftp()
-        sftp_client.get_channel().settimeout(180.0)  # Timeout de 3 minutes pour les opérations SFTP
-        log_capture.add(f"✅ Session SFTP établie")
-        log_capture.add(f"📁 Répertoire cible: {request.remote_path}")
-        
-        # Lister les fichiers disponibles
-        try:
-            log_capture.add(f"🔍 Listage des fichiers dans {request.remote_path}...")
-            available_files = sftp_client.listdir(request.remote_path)
-            log_capture.add(f"📋 Fichiers disponibles: {len(available_files)} fichier(s)")
-            if len(available_files) <= 10:
-                log_capture.add(f"   Fichiers: {', '.join(available_files)}")
-            else:
-                log_capture.add(f"   Premiers fichiers: {', '.join(available_files[:10])}...")
-        except Exception as e:
-            log_capture.add(f"❌ Erreur lors du listage: {str(e)}")
-            raise HTTPException(
-                status_code=400,
-                detail=f"Impossible d'accéder au répertoire {request.remote_path}: {str(e)}"
+        # Session SFTP issue du pool (réutilisée ou nouvellement ouverte)
+        async with AsyncExitStack() as session:
+            sftp = await session.enter_async_context(
+                sftp_pool.acquire(request.connection, private_key, key_fp, log_capture)
             )
-        
-        # Chercher et télécharger les fichiers attendus
-        expected_filenames = [f.filename for f in request.expected_files]
-        log_capture.add(f"📦 Téléchargement de {len(request.expected_files)} fichier(s) attendu(s)...")
-        
-        for expected_file in request.expected_files:
-            filename = expected_file.filename
+            log_capture.add(f"📁 Répertoire cible: {request.remote_path}")
             
-            # Vérifier si le fichier existe
-            if filename not in available_files:
-                log_capture.add(f"⚠️ Fichier manquant: {filename}")
-                missing_files.append(filename)
-                continue
+            # Lister les fichiers disponibles, en s'arrêtant dès que tous les fichiers attendus sont vus
+            expected_filenames = {f.filename for f in request.expected_files}
+            available_files = set()
+            if expected_filenames:
+                try:
+                    log_capture.add(f"🔍 Listage des fichiers dans {request.remote_path}...")
+                    async with aclosing(sftp.scandir(request.remote_path)) as entries:
+                        async for entry in entries:
+                            if entry.filename in expected_filenames:
+                                available_files.add(entry.filename)
+                                if len(available_files) == len(expected_filenames):
+                                    break
+                    log_capture.add(f"📋 Fichiers attendus présents: {len(available_files)}/{len(expected_filenames)}")
+                except Exception as e:
+                    log_capture.add(f"❌ Erreur lors du listage: {str(e)}")
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Impossible d'accéder au répertoire {request.remote_path}: {str(e)}"
+                    )
             
-            # Télécharger le fichier
-            try:
-                remote_file_path = f"{request.remote_path}/{filename}"
-                file_data = io.BytesIO()
-                
-                download_start = datetime.utcnow()
-                log_capture.add(f"⬇️ Téléchargement: {filename}")
-                
-                # Vérifier la taille du fichier d'abord
-                file_attrs = sftp_client.stat(remote_file_path)
-                file_size_mb = file_attrs.st_size / (1024 * 1024)
-                log_capture.add(f"   Taille: {file_size_mb:.2f} MB")
-                
-                sftp_client.getfo(remote_file_path, file_data)
-                file_data.seek(0)
-                
-                download_duration = (datetime.utcnow() - download_start).total_seconds()
-                log_capture.add(f"   ✅ Terminé en {download_duration:.2f}s")
-                
-                # Encoder en base64
-                file_content = file_data.read()
-                content_base64 = base64.b64encode(file_content).decode('utf-8')
-                
-                downloaded_files.append(DownloadedFile(
-                    filename=filename,
-                    content_base64=content_base64,
-                    size=len(file_content),
-                    download_time=datetime.utcnow().isoformat()
-                ))
-                
-                log_capture.add(f"✓ {filename} téléchargé ({len(file_content)} bytes)")
-                
-            except Exception as e:
-                log_capture.add(f"❌ Erreur téléchargement {filename}: {str(e)}")
-                missing_files.append(filename)
+            # Réponse en flux : la session est confiée à la réponse, qui la libère en fin d'envoi
+            if accepts_multipart(accept):
+                boundary = uuid.uuid4().hex
+                return SessionStreamingResponse(
+                    stream_files(sftp, request, available_files, boundary, start_time, log_capture),
+                    session=session.pop_all(),
+                    media_type=f"multipart/mixed; boundary={boundary}"
+                )
+            
+            # Chercher et télécharger les fichiers attendus
+            log_capture.add(f"📦 Téléchargement de {len(request.expected_files)} fichier(s) attendu(s)...")
+            
+            # Un fichier demandé plusieurs fois n'est téléchargé qu'une seule fois
+            unique_files = list({f.filename: f for f in request.expected_files}.values())
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+            results = await asyncio.gather(
+                *(fetch_one(sftp, request.remote_path, f, available_files, semaphore, log_capture)
+                  for f in unique_files),
+                return_exceptions=True
+            )
+            results_by_name = dict(zip((f.filename for f in unique_files), results))
+            
+            for expected_file in request.expected_files:
+                result = results_by_name[expected_file.filename]
+                if isinstance(result, DownloadedFile):
+                    downloaded_files.append(result)
+                    total_size += result.size
+                else:
+                    missing_files.append(expected_file.filename)
         
         # Calculer les statistiques
-        end_time = datetime.utcnow()
-        duration = (end_time - start_time).total_seconds()
-        total_size = sum(f.size for f in downloaded_files)
+        duration = (time.monotonic_ns() - start_time) / 1e9
         
         stats = {
-            "total_expected": len(expected_filenames),
+            "total_expected": len(request.expected_files),
             "total_downloaded": len(downloaded_files),
             "total_missing": len(missing_files),
             "total_size_bytes": total_size,
             "duration_seconds": round(duration, 2)
         }
         
-        log_capture.add(f"✅ Téléchargement terminé: {len(downloaded_files)}/{len(expected_filenames)} fichier(s)")
+        log_capture.add(f"✅ Téléchargement terminé: {len(downloaded_files)}/{len(request.expected_files)} fichier(s)")
         
         return DownloadResponse(
             success=len(missing_files) == 0,
@@ -271,14 +764,16 @@ async def download_files(request: DownloadRequest):
             logs=log_capture.get_logs()
         )
         
-    except paramiko.AuthenticationException:
+    except HTTPException:
+        raise
+    except asyncssh.PermissionDenied:
         log_capture.add("❌ Échec d'authentification SFTP")
         logger.error("Échec d'authentification SFTP")
         raise HTTPException(
             status_code=401,
             detail="Échec d'authentification SFTP. Vérifiez les identifiants et la clé privée."
         )
-    except paramiko.SSHException as e:
+    except asyncssh.Error as e:
         log_capture.add(f"❌ Erreur SSH: {str(e)}")
         logger.error(f"Erreur SSH: {str(e)}")
         raise HTTPException(
@@ -292,14 +787,15 @@ async def download_files(request: DownloadRequest):
             status_code=500,
             detail=f"Erreur lors du téléchargement: {str(e)}"
         )
-    finally:
-        # Fermer les connexions
-        if sftp_client:
-            sftp_client.close()
-        if ssh_client:
-            ssh_client.close()
-        logger.info("Connexions fermées")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Chaque worker a son propre pool SFTP : ajuster WEB_CONCURRENCY avec SFTP_POOL_MAX_SIZE
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",  # uvloop si installé
+        http="auto",  # httptools si installé
+        workers=int(os.getenv("WEB_CONCURRENCY", min(os.cpu_count() or 1, 4)))
+    )